@@ -27,12 +27,10 @@ def padding_mask(vec: th.Tensor) -> th.Tensor:
             [False, False, False, False, False, False],
             [False,  True,  True,  True,  True,  True]])
     """
-    N = vec.shape[-1]
     # vector may not in sorted order
     M = vec.max().item()
-    templ = th.arange(M, device=vec.device).repeat([N, 1])
-    mask = (templ >= vec.unsqueeze(1))
-    return mask
+    # 1 x M >= N x 1 => N x M, broadcasted without the N x M template
+    return th.arange(M, device=vec.device) >= vec.unsqueeze(1)
 
 
 def att_instance(att_type: str, enc_dim: int, dec_dim: int,
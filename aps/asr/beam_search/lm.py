@@ -9,11 +9,37 @@ import torch.nn.functional as tf
 
 from typing import Union, Tuple
 from aps.asr.lm.ngram import NgramLM
+from aps.asr.transformer.impl import ApsMultiheadAttention
 
 HiddenType = Union[th.Tensor, Tuple[th.Tensor, th.Tensor]]
 LmType = Union[nn.Module, NgramLM]
 
 
+def quantize_lm(lm: LmType) -> LmType:
+    """
+    Apply int8 dynamic quantization (Linear & RNN weights) to the NN LM,
+    only for the shallow fusion on CPU (NgramLM is returned as it is)
+    Args:
+        lm (NgramLM or Module): LM used in beam search
+    Return:
+        lm (NgramLM or Module): quantized LM
+    """
+    if isinstance(lm, NgramLM):
+        return lm
+    # out_proj of the attention is consumed as a weight tensor when
+    # calling tf.multi_head_attention_forward(...), so we keep it as float
+    keep = [
+        f"{name}.out_proj" for name, mod in lm.named_modules()
+        if isinstance(mod, ApsMultiheadAttention)
+    ]
+    qconfig = {
+        name: th.quantization.default_dynamic_qconfig
+        for name, mod in lm.named_modules()
+        if isinstance(mod, (nn.Linear, nn.LSTM, nn.GRU)) and name not in keep
+    }
+    return th.quantization.quantize_dynamic(lm, qconfig, dtype=th.qint8)
+
+
 def adjust_hidden(back_point: th.Tensor, state: HiddenType) -> HiddenType:
     """
     Adjust RNN hidden states
@@ -9,48 +9,177 @@ import torch as th
 import torch.nn as nn
 import torch.nn.functional as tf
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union, Callable
+from aps.asr.beam_search.lm import LmType
+from aps.asr.lm.ngram import NgramLM
 from aps.utils import get_logger
 
 logger = get_logger(__name__)
 
+HiddenType = Union[th.Tensor, Tuple, List]
+# modulus of the prefix hash (Mersenne prime 2^61 - 1)
+HASH_MOD = (1 << 61) - 1
 
-class Node(object):
+
+def hidden_shape(hidden: Optional[HiddenType]) -> Optional[Tuple]:
+    """
+    Return the shape of the (nested) decoder hidden states
+    """
+    if hidden is None:
+        return None
+    if isinstance(hidden, th.Tensor):
+        return tuple(hidden.shape)
+    return tuple(hidden_shape(h) for h in hidden)
+
+
+def stack_hidden(hidden_list: List[HiddenType]) -> HiddenType:
     """
-    Beam node for RNNT beam search
+    Stack the decoder hidden states of the hypothesis (batch dimension is 1)
     """
+    ref = hidden_list[0]
+    if isinstance(ref, th.Tensor):
+        return th.cat(hidden_list, 1)
+    return type(ref)(stack_hidden(list(h)) for h in zip(*hidden_list))
 
-    def __init__(self, score: th.Tensor, stats: Dict) -> None:
-        self.score = score
-        self.stats = stats
 
-    def __getitem__(self, key):
-        return self.stats[key]
+def split_hidden(hidden: HiddenType, num_hypos: int) -> List[HiddenType]:
+    """
+    Split the stacked decoder hidden states (reverse of stack_hidden)
+    """
+    if isinstance(hidden, th.Tensor):
+        return [hidden[:, i:i + 1] for i in range(num_hypos)]
+    split = [split_hidden(h, num_hypos) for h in hidden]
+    return [type(hidden)(s[i] for s in split) for i in range(num_hypos)]
 
 
-def merge_hypos(hypos_list: List[Node]) -> List[Node]:
+def batch_step(
+        step: Callable, token: th.Tensor, hidden: List[Optional[HiddenType]]
+) -> Tuple[th.Tensor, List[HiddenType]]:
     """
-    Merge the hypos that has the same prefix
+    Make one step (decoder or LM) for a batch of hypothesis. The hypothesis that
+    have the same shape of the hidden states are stacked and go through the
+    network once, so for RNNs, it's always one call for the whole beam.
+    Args:
+        step (callable): step function, e.g., decoder.step
+        token (Tensor): N, last token of each hypothesis
+        hidden (list): hidden states of each hypothesis
+    Return:
+        dec_out (Tensor): N x D
+        hidden (list): updated hidden states of each hypothesis
     """
-    merge_dict = {}
-    for hypos in hypos_list:
-        prefix_str = hypos["hashid"]
-        if prefix_str in merge_dict:
-            merge_dict[prefix_str].score = th.logaddexp(
-                hypos.score, merge_dict[prefix_str].score)
+    groups = {}
+    for i, h in enumerate(hidden):
+        groups.setdefault(hidden_shape(h), []).append(i)
+    dec_out = []
+    order = []
+    ret_hidden = [None] * len(hidden)
+    for index in groups.values():
+        # N x 1, tokens are kept on device
+        if len(groups) == 1:
+            tok = token[:, None]
         else:
-            merge_dict[prefix_str] = hypos
-    merge_list = [value for _, value in merge_dict.items()]
-    return sorted(merge_list, key=lambda n: n.score, reverse=True)
+            tok = token[th.tensor(index, device=token.device), None]
+        hid = hidden[index[0]]
+        if hid is not None:
+            hid = stack_hidden([hidden[i] for i in index])
+        # N x D
+        out, hid = step(tok, hidden=hid)
+        for i, h in zip(index, split_hidden(hid, len(index))):
+            ret_hidden[i] = h
+        dec_out.append(out)
+        order += index
+    dec_out = th.cat(dec_out, 0)
+    if len(groups) > 1:
+        # recover the order of the hypothesis
+        back = [0] * len(order)
+        for i, j in enumerate(order):
+            back[j] = i
+        dec_out = dec_out[th.tensor(back, device=dec_out.device)]
+    return dec_out, ret_hidden
+
+
+def lm_step(lm: LmType, token: th.Tensor,
+            state: Optional[List]) -> Tuple[th.Tensor, List]:
+    """
+    Make one LM step for a batch of hypothesis
+    Args:
+        token (Tensor): N, last token of each hypothesis
+        state (list): LM states of each hypothesis (None for initial states)
+    Return:
+        score (Tensor): N x V, LM scores
+        state (list): updated LM states of each hypothesis
+    """
+    if isinstance(lm, NgramLM):
+        # NgramLM runs hypothesis one by one and keeps list of states
+        return lm(token, state)
+
+    def nnlm_step(tok, hidden=None):
+        lmout, hidden = lm(tok, hidden)
+        return tf.log_softmax(lmout[:, -1], dim=-1), hidden
+
+    if state is None:
+        state = [None] * len(token)
+    return batch_step(nnlm_step, token, state)
+
+
+def prefix_hash(prev: int, token: int) -> int:
+    """
+    Rolling hash of the prefix, updated in O(1) for each new token
+    """
+    return (prev * 1000003 + token + 1) % HASH_MOD
+
+
+def match_hypos(hash_a: List[int],
+                slot_b: Dict[int, int]) -> Tuple[List[int], List[int]]:
+    """
+    Match the hypothesis in A with the ones already in B (by prefix hash)
+    Args:
+        hash_a (list[int]): prefix hash of the hypothesis in A
+        slot_b (dict): prefix hash => index in B, updated for the new ones
+    Return:
+        new (list[int]): index (in A) of the hypothesis not in B
+        dup (list[tuple(int, int)]): index (in A, in B) of the duplicated ones
+    """
+    new, dup = [], []
+    for i, h in enumerate(hash_a):
+        if h in slot_b:
+            dup.append((i, slot_b[h]))
+        else:
+            slot_b[h] = len(slot_b)
+            new.append(i)
+    return new, dup
+
+
+def prep_nbest(score: th.Tensor,
+               trans: List[List[int]],
+               nbest: int = 8,
+               len_norm: bool = True,
+               blank: int = 0) -> List[Dict]:
+    """
+    Return the n-best hypothesis
+    Args:
+        score (Tensor): N
+        trans (list[list[int]]): N
+    """
+    if len_norm:
+        score = score / th.tensor([len(t) for t in trans], device=score.device)
+    # partial sort, only the n-best ones are kept
+    score, index = th.topk(score, min(nbest, score.shape[0]))
+    return [{
+        "score": s,
+        "trans": trans[i] + [blank]
+    } for s, i in zip(score.tolist(), index.tolist())]
 
 
 def greedy_search(decoder: nn.Module,
                   enc_out: th.Tensor,
-                  blank: int = 0) -> List[Dict]:
+                  blank: int = 0,
+                  chunk_size: int = 8) -> List[Dict]:
     """
     Greedy search algorithm for RNN-T
     Args:
         enc_out: N x Ti x D
+        chunk_size: max number of frames predicted together
     """
     if blank < 0:
         raise RuntimeError(f"Invalid blank ID: {blank:d}")
@@ -60,31 +189,55 @@ def greedy_search(decoder: nn.Module,
             f"Got batch size {N:d}, now only support one utterance")
     if not hasattr(decoder, "step"):
         raise RuntimeError("Function step should defined in decoder network")
-    if not hasattr(decoder, "pred"):
-        raise RuntimeError("Function pred should defined in decoder network")
+    if not hasattr(decoder, "joint"):
+        raise RuntimeError("Function joint should defined in decoder network")
 
+    # encoder side of the joint network is done once for the utterance: T x J
+    enc_proj = decoder.enc_proj(enc_out[0])
     blk = th.tensor([[blank]], dtype=th.int64, device=enc_out.device)
     dec_out, hidden = decoder.step(blk)
-    score = 0
+    # 1 x J, changes only when a non-blank token is emitted
+    dec_proj = decoder.dec_proj(dec_out)
+    # accumulate on device, avoid synchronization for each frame
+    score = th.zeros((), device=enc_out.device)
     trans = []
-    for t in range(T):
-        # 1 x V
-        prob = tf.log_softmax(decoder.pred(enc_out[:, t], dec_out)[0], dim=-1)
+    t = 0
+    size = chunk_size
+    while t < T:
+        # decoder output keeps unchanged until a non-blank token is emitted,
+        # so the frames in one chunk are predicted at once: C x V
+        pred = decoder.joint(enc_proj[t:t + size], dec_proj)[:, 0]
+        prob = tf.log_softmax(pred, dim=-1)
         best_prob, best_pred = th.max(prob, dim=-1)
-        score += best_prob.item()
-        # not blank
-        if best_pred.item() != blank:
-            dec_out, hidden = decoder.step(best_pred[None, ...], hidden=hidden)
-            trans += [best_pred.item()]
-    return [{"score": score, "trans": [blank] + trans + [blank]}]
+        # one synchronization for each chunk
+        best_tok = best_pred.tolist()
+        # the first non-blank frame in the chunk
+        emit = [c for c, tok in enumerate(best_tok) if tok != blank]
+        if not emit:
+            score += best_prob.sum()
+            t += len(best_tok)
+            # blank run, grow the chunk again
+            size = min(size * 2, chunk_size)
+            continue
+        c = emit[0]
+        score += best_prob[:c + 1].sum()
+        dec_out, hidden = decoder.step(best_pred[c:c + 1, None], hidden=hidden)
+        dec_proj = decoder.dec_proj(dec_out)
+        trans += [best_tok[c]]
+        t += c + 1
+        # frames after c are predicted again with the new decoder output, so
+        # shrink the chunk to the current blank run (dense emissions => 1)
+        size = c + 1
+    return [{"score": score.item(), "trans": [blank] + trans + [blank]}]
 
 
 def beam_search(decoder: nn.Module,
                 enc_out: th.Tensor,
-                lm: Optional[nn.Module] = None,
+                lm: Optional[LmType] = None,
                 lm_weight: float = 0,
                 beam_size: int = 16,
                 blank: int = 0,
+                sos: int = -1,
                 nbest: int = 8,
                 len_norm: bool = True) -> List[Dict]:
     """
@@ -92,6 +245,7 @@ def beam_search(decoder: nn.Module,
     Args:
         enc_out: N(=1) x Ti x D
         blank: #vocab_size - 1
+        sos: start token of the LM (<sos> in the dictionary)
     """
     N, T, _ = enc_out.shape
     if N != 1:
@@ -103,78 +257,134 @@ def beam_search(decoder: nn.Module,
         raise RuntimeError("Function pred should defined in decoder network")
     if beam_size > decoder.vocab_size:
         raise RuntimeError(f"Beam size({beam_size}) > vocabulary size")
-    if lm and lm.vocab_size < decoder.vocab_size:
+    if isinstance(lm, nn.Module) and lm.vocab_size < decoder.vocab_size - 1:
         raise RuntimeError("lm.vocab_size < am.vocab_size, "
                            "seems different dictionary is used")
     if blank != decoder.vocab_size - 1:
         raise RuntimeError("Hard code for blank = self.vocab_size - 1 here")
+    if isinstance(lm, nn.Module) and lm_weight > 0 and sos < 0:
+        raise RuntimeError(f"Unsupported SOS value: {sos} when using NN LM")
 
     nbest = min(beam_size, nbest)
 
+    V = decoder.vocab_size
     device = enc_out.device
-    blk = th.tensor([blank], dtype=th.int64, device=device)
-    init_node = Node(th.tensor(0.0), {
-        "hashid": f"{blk}",
-        "prefix": [blk],
-        "hidden": None,
-    })
+    use_lm = lm is not None and lm_weight > 0
     # list_a, list_b: A, B in Sequence Transduction with Recurrent Neural Networks: Algorithm 1
-    list_b = [init_node]
+    # all the hypothesis in A are expanded at the same time (in batch). For
+    # both A and B, we keep scores (Tensor), trans (list[int]), the decoder
+    # output & hidden states and the LM scores & states after the trans is
+    # consumed, so the decoder and LM run only once for each prefix. A prefix
+    # may go into B several times in one frame (e.g., a + b and ab), they are
+    # merged (logsumexp) by the prefix hash, so B has no duplicated ones.
+    # the only token tensors created on host, the others come from topk
+    blk = th.tensor([blank], dtype=th.int64, device=device)
+    dec_out_b, hidden = decoder.step(blk[:, None])
+    score_b = th.zeros(1, device=device)
+    trans_b = [[blank]]
+    hash_b = [prefix_hash(0, blank)]
+    hidden_b = split_hidden(hidden, 1)
+    if use_lm:
+        # LM starts from <sos> (blank is out of the LM vocabulary)
+        lm_prob_b, lm_state_b = lm_step(
+            lm, th.tensor([sos], dtype=th.int64, device=device), None)
+        lm_prob_b = lm_prob_b[:, :V - 1]
+    else:
+        # no dummy LM scores are kept without LM
+        lm_prob_b, lm_state_b = None, [None]
     for t in range(T):
-        # merge hypos, return in order
-        list_a = merge_hypos(list_b)
-        # logger.info(f"--- merge hypos: {len(list_b)} -> {len(list_a)}")
-        list_b = []
-        # for _ in range(beam_size):
+        # hypos in B are unique, keep the best ones
+        score_a, index = th.topk(score_b, min(beam_size, score_b.shape[0]))
+        dec_out_a = dec_out_b[index]
+        lm_prob_a = lm_prob_b[index] if use_lm else None
+        index = index.tolist()
+        trans_a = [trans_b[i] for i in index]
+        hash_a = [hash_b[i] for i in index]
+        hidden_a = [hidden_b[i] for i in index]
+        lm_state_a = [lm_state_b[i] for i in index]
+        score_b = th.zeros(0, device=device)
+        dec_out_b = dec_out_a[:0]
+        lm_prob_b = lm_prob_a[:0] if use_lm else None
+        trans_b, hash_b, hidden_b, lm_state_b = [], [], [], []
+        # prefix hash => index in B
+        slot_b = {}
+        # 1 x D, shared by all the expansions in frame t (broadcast in pred)
+        enc_t = enc_out[:, t]
         while True:
-            # pop the best node
-            cur_node = list_a[0]
-            list_a = list_a[1:]
-
-            prefix_str = cur_node["hashid"]
-            prefix_tok = cur_node["prefix"]
-
-            # decoder step
-            dec_out, hidden = decoder.step(prefix_tok[-1][..., None],
-                                           hidden=cur_node["hidden"])
-
-            # predict: N x 1 x V => V
-            pred = decoder.pred(enc_out[:, t], dec_out)[0, 0]
-            prob = tf.log_softmax(pred, dim=-1)
-
-            # add terminal node (end with blank)
-            score = cur_node.score + prob[blank]
-            blank_node = Node(
-                score, {
-                    "hashid": prefix_str,
-                    "prefix": prefix_tok,
-                    "hidden": cur_node["hidden"],
-                })
-            list_b.append(blank_node)
-
-            # extend other nodes
-            topk_score, topk_index = th.topk(prob[:-1], beam_size)
-            for i in range(beam_size):
-                score = cur_node.score + topk_score[i]
-                node = Node(
-                    score, {
-                        "hashid": prefix_str + f",{topk_index[i].item()}",
-                        "prefix": prefix_tok + [topk_index[None, i]],
-                        "hidden": hidden
-                    })
-                list_a.append(node)
-            # sort A
-            list_a = sorted(list_a, key=lambda n: n.score, reverse=True)
+            # predict: N x 1 x V => N x V
+            pred = decoder.pred(enc_t, dec_out_a)[:, 0]
+            am_prob = tf.log_softmax(pred, dim=-1)
+
+            # add terminal nodes (end with blank)
+            blank_score = score_a + am_prob[:, blank]
+            new, dup = match_hypos(hash_a, slot_b)
+            if dup:
+                # merge the duplicated ones, decoder & LM states are same
+                dup_a, dup_b = [th.tensor(i, device=device) for i in zip(*dup)]
+                score_b[dup_b] = th.logaddexp(score_b[dup_b],
+                                              blank_score[dup_a])
+                new_a = th.tensor(new, dtype=th.int64, device=device)
+                blank_score = blank_score[new_a]
+                dec_out_b = th.cat([dec_out_b, dec_out_a[new_a]])
+                if use_lm:
+                    lm_prob_b = th.cat([lm_prob_b, lm_prob_a[new_a]])
+            else:
+                dec_out_b = th.cat([dec_out_b, dec_out_a])
+                if use_lm:
+                    lm_prob_b = th.cat([lm_prob_b, lm_prob_a])
+            score_b = th.cat([score_b, blank_score])
+            trans_b += [trans_a[i] for i in new]
+            hash_b += [hash_a[i] for i in new]
+            hidden_b += [hidden_a[i] for i in new]
+            lm_state_b += [lm_state_a[i] for i in new]
+
+            # scores of the other nodes: N x V-1
+            fusion_score = score_a[:, None] + am_prob[:, :-1]
+            if use_lm:
+                fusion_score += lm_weight * lm_prob_a
+
             # while B contains less than W elements more probable than the most probable in A
-            cur_list_b = [n for n in list_b if n.score > list_a[0].score]
-            if len(cur_list_b) >= beam_size:
-                list_b = cur_list_b
+            # only the best one is needed here, so the frame that stops in
+            # the first round (mostly blank frames) skips the topk below
+            keep = th.nonzero(score_b > fusion_score.max(), as_tuple=True)[0]
+            if keep.shape[0] >= beam_size:
+                score_b = score_b[keep]
+                dec_out_b = dec_out_b[keep]
+                if use_lm:
+                    lm_prob_b = lm_prob_b[keep]
+                keep = keep.tolist()
+                trans_b = [trans_b[i] for i in keep]
+                hash_b = [hash_b[i] for i in keep]
+                hidden_b = [hidden_b[i] for i in keep]
+                lm_state_b = [lm_state_b[i] for i in keep]
                 break
 
-    final_hypos = [{
-        "score": n.score.item() / (len(n["prefix"]) if len_norm else 1),
-        "trans": [t.item() for t in n["prefix"]] + [blank]
-    } for n in merge_hypos(list_b)]
-    # return best
-    nbest_hypos = sorted(final_hypos, key=lambda n: n["score"], reverse=True)
-    return nbest_hypos[:nbest]
+            # extend other nodes: N x V-1 => beam
+            topk_score, topk_index = th.topk(fusion_score.view(-1), beam_size)
+            point = (topk_index // (V - 1)).tolist()
+            # beam, stay on device for the decoder & LM step
+            token = topk_index % (V - 1)
+            score_a = topk_score
+            token_list = token.tolist()
+            trans_a = [trans_a[p] + [tok] for p, tok in zip(point, token_list)]
+            hash_a = [
+                prefix_hash(hash_a[p], tok)
+                for p, tok in zip(point, token_list)
+            ]
+            # decoder & LM step for the new hypothesis, (parent, token) pairs
+            # from topk are unique, so each prefix goes through them only once
+            dec_out_a, hidden_a = batch_step(decoder.step, token,
+                                             [hidden_a[p] for p in point])
+            if use_lm:
+                # N x V
+                lm_prob_a, lm_state_a = lm_step(lm, token,
+                                                [lm_state_a[p] for p in point])
+                lm_prob_a = lm_prob_a[:, :V - 1]
+            else:
+                lm_state_a = [None] * beam_size
+
+    return prep_nbest(score_b,
+                      trans_b,
+                      nbest=nbest,
+                      len_norm=len_norm,
+                      blank=blank)
@@ -54,7 +54,9 @@ class TorchXfmrLM(nn.Module):
         hidden = token_embed if hidden is None else th.cat(
             [hidden, token_embed], dim=0)
         # tgt_mask: T x T
-        tgt_mask = prep_sub_mask(hidden.shape[0], device=hidden.device)
+        tgt_mask = prep_sub_mask(hidden.shape[0],
+                                 device=hidden.device,
+                                 dtype=hidden.dtype)
         # src_pad_mask: N x T
         src_pad_mask = None if token_len is None else (padding_mask(token_len)
                                                        == 1)
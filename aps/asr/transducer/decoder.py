@@ -96,8 +96,19 @@ class DecoderBase(nn.Module):
         enc_out = self.enc_proj(enc_out)
         # N x To+1 x J or N x J
         dec_out = self.dec_proj(dec_out)
+        return self.joint(enc_out, dec_out)
+
+    def joint(self, enc_proj: th.Tensor, dec_proj: th.Tensor) -> th.Tensor:
+        """
+        Joint network prediction on the projected encoder & decoder outputs
+        Args:
+            enc_proj: N x Ti x J or N x J
+            dec_proj: N x To+1 x J or N x J
+        Return:
+            output: N x Ti x To+1 x V or N x 1 x V
+        """
         # N x Ti x To+1 x J or N x 1 x J
-        add_out = th.tanh(enc_out.unsqueeze(-2) + dec_out.unsqueeze(1))
+        add_out = th.tanh(enc_proj.unsqueeze(-2) + dec_proj.unsqueeze(1))
         # N x Ti x To+1 x V or N x 1 x V
         return self.output(add_out)
 
@@ -199,10 +210,12 @@ class TorchTransformerDecoder(DecoderBase):
         """
         # N x Ti
         pad_mask = None if tgt_len is None else (padding_mask(tgt_len) == 1)
-        # genrarte target masks (-inf/0)
-        tgt_mask = prep_sub_mask(tgt_pad.shape[-1], device=tgt_pad.device)
         # To+1 x N x E
         tgt_pad = self.abs_pos_enc(self.vocab_embed(tgt_pad))
+        # genrarte target masks (-inf/0)
+        tgt_mask = prep_sub_mask(tgt_pad.shape[0],
+                                 device=tgt_pad.device,
+                                 dtype=tgt_pad.dtype)
         # To+1 x N x D
         dec_out = self.decoder(tgt_pad,
                                src_mask=tgt_mask,
@@ -225,6 +238,8 @@ class TorchTransformerDecoder(DecoderBase):
         pred_prev_emb = self.abs_pos_enc(self.vocab_embed(pred_prev), t=t)
         hidden = pred_prev_emb if hidden is None else th.cat(
             [hidden, pred_prev_emb], dim=0)
-        tgt_mask = prep_sub_mask(t + 1, device=pred_prev.device)
+        tgt_mask = prep_sub_mask(t + 1,
+                                 device=pred_prev.device,
+                                 dtype=hidden.dtype)
         dec_out = self.decoder(hidden, mask=tgt_mask)
         return dec_out[-1], hidden
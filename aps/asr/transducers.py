@@ -56,6 +56,7 @@ class ASRTransducerBase(ASREncoderBase):
                     nbest: int = 8,
                     len_norm: bool = True,
                     max_len: int = -1,
+                    sos: int = -1,
                     **kwargs) -> List[Dict]:
         """
         Beam search for TransducerASR
@@ -66,6 +67,7 @@ class ASRTransducerBase(ASREncoderBase):
                                enc_out,
                                beam_size=beam_size,
                                blank=self.blank,
+                               sos=sos,
                                nbest=nbest,
                                lm=lm,
                                lm_weight=lm_weight,
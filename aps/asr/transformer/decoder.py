@@ -154,7 +154,9 @@ class TorchTransformerDecoder(nn.Module):
         if pre_emb is not None:
             tgt_emb = th.cat([pre_emb, tgt_emb], dim=0)
         # T+T' x T+T'
-        tgt_mask = prep_sub_mask(tgt_emb.shape[0], device=tgt_pad.device)
+        tgt_mask = prep_sub_mask(tgt_emb.shape[0],
+                                 device=tgt_pad.device,
+                                 dtype=tgt_emb.dtype)
         # To+1 x N x D
         dec_out = self.decoder(tgt_emb,
                                enc_out,
@@ -59,14 +59,14 @@ class ApsMultiheadAttention(nn.Module):
             key (Tensor): S x N x H x D
             value (Tensor): S x N x H x D
         """
-        if th.equal(query, key) and th.equal(value, key):
+        if query is key and value is key:
             # T x N x HD*3
             stack = tf.linear(query, self.in_proj_weight, self.in_proj_bias)
             query, key, value = th.chunk(stack, 3, dim=-1)
         else:
             query = tf.linear(query, self.in_proj_weight[:self.embed_dim],
                               self.in_proj_bias[:self.embed_dim])
-            if th.equal(key, value):
+            if key is value:
                 stack = tf.linear(key, self.in_proj_weight[self.embed_dim:],
                                   self.in_proj_bias[self.embed_dim:])
                 key, value = th.chunk(stack, 2, dim=-1)
@@ -99,16 +99,21 @@ class ApsMultiheadAttention(nn.Module):
             context (Tensor): L x N x H x D
             weight (Tensor): L x N x H x S
         """
-        logit = logit / (self.head_dim)**0.5
+        # masking & softmax are done in fp32 if the logit is in bf16/fp16
+        # (e.g., under autocast), cast back to the dtype of the value after
+        if logit.dtype == th.float16 or logit.dtype == th.bfloat16:
+            logit = logit.float()
+        logit = logit * self.head_dim**-0.5
         if key_padding_mask is not None:
             logit = logit.masked_fill(key_padding_mask[None, :, None, :],
                                       float("-inf"))
         if attn_mask is not None:
             logit += attn_mask[:, None, None, :]
         # L x N x H x S
-        weight = self.dropout(th.softmax(logit, dim=-1))
-        # L x N x H x D
-        context = th.einsum("lnhs,snhd->lnhd", weight, value)
+        weight = self.dropout(th.softmax(logit, dim=-1)).to(value.dtype)
+        # N x H x L x S @ N x H x S x D => N x H x L x D => L x N x H x D
+        context = th.matmul(weight.permute(1, 2, 0, 3),
+                            value.permute(1, 2, 0, 3)).permute(2, 0, 1, 3)
         return context, weight
 
     def dot_att(self, query: th.Tensor, key: th.Tensor) -> th.Tensor:
@@ -120,14 +125,17 @@ class ApsMultiheadAttention(nn.Module):
         Return:
             logit (Tensor): L x N x H x S
         """
-        return th.einsum("lnhd,snhd->lnhs", query, key)
+        # N x H x L x D @ N x H x D x S => N x H x L x S => L x N x H x S
+        return th.matmul(query.permute(1, 2, 0, 3),
+                         key.permute(1, 2, 3, 0)).permute(2, 0, 1, 3)
 
-    def wrap_out(self, context: th.Tensor, weight: th.Tensor) -> MHSAReturnType:
+    def wrap_out(self, context: th.Tensor,
+                 weight: Optional[th.Tensor]) -> MHSAReturnType:
         """
         Return context & weight tensor
         Args:
             context (Tensor): L x N x H x D
-            weight (Tensor): L x N x H x S
+            weight (Tensor): L x N x H x S or None
         Return:
             context (Tensor): L x N x E
             weight (Tensor): N x L x S
@@ -137,17 +145,20 @@ class ApsMultiheadAttention(nn.Module):
                                             self.embed_dim)
         # L x N x E
         context = self.out_proj(context)
-        # L x N x S => N x L x S
-        weight = weight.mean(-2).transpose(0, 1)
+        if weight is None:
+            return [context]
+        # L x N x H x S => L x N x S => N x L x S
+        weight = weight.mean(2).transpose(0, 1)
         # return
-        return context, weight
+        return [context, weight]
 
     def torch_forward(self,
                       query: th.Tensor,
                       key: th.Tensor,
                       value: th.Tensor,
                       key_padding_mask: Optional[th.Tensor] = None,
-                      attn_mask: Optional[th.Tensor] = None) -> MHSAReturnType:
+                      attn_mask: Optional[th.Tensor] = None,
+                      need_weights: bool = True) -> MHSAReturnType:
         """
         Args:
             query (Tensor): L x N x E
@@ -155,10 +166,14 @@ class ApsMultiheadAttention(nn.Module):
             value (Tensor): S x N x E
             key_padding_mask (Tensor): N x S
             attn_mask (Tensor): L x S, additional mask
+            need_weights (bool): return attention weight or not
         Return:
             context (Tensor): L x N x E
             weight (Tensor): N x L x S
         """
+        if attn_mask is not None:
+            # float mask should have the same dtype with query
+            attn_mask = attn_mask.to(query.dtype)
         context, weight = tf.multi_head_attention_forward(
             query,
             key,
@@ -175,7 +190,7 @@ class ApsMultiheadAttention(nn.Module):
             self.out_proj.bias,
             training=self.training,
             key_padding_mask=key_padding_mask,
-            need_weights=True,
+            need_weights=need_weights,
             attn_mask=attn_mask)
         if weight is None:
             return [context]
@@ -188,7 +203,8 @@ class ApsMultiheadAttention(nn.Module):
                 value: th.Tensor,
                 placehold: Optional[th.Tensor] = None,
                 key_padding_mask: Optional[th.Tensor] = None,
-                attn_mask: Optional[th.Tensor] = None) -> MHSAReturnType:
+                attn_mask: Optional[th.Tensor] = None,
+                need_weights: bool = False) -> MHSAReturnType:
         """
         Args:
             query (Tensor): L x N x E
@@ -197,16 +213,18 @@ class ApsMultiheadAttention(nn.Module):
             placehold (None): keep compatiable with rel/xl-attention layer
             key_padding_mask (Tensor): N x S
             attn_mask (Tensor): L x S, additional mask
+            need_weights (bool): return attention weight or not
         Return:
             context (Tensor): L x N x E
-            weight (Tensor): N x L x S
+            weight (Tensor): N x L x S (if need_weights is True)
         """
         if self.use_torch:
             return self.torch_forward(query,
                                       key,
                                       value,
                                       key_padding_mask=key_padding_mask,
-                                      attn_mask=attn_mask)
+                                      attn_mask=attn_mask,
+                                      need_weights=need_weights)
         # query: L x N x H x D
         # key, value: S x N x H x D
         query, key, value = self.inp_proj(query, key, value)
@@ -217,7 +235,7 @@ class ApsMultiheadAttention(nn.Module):
                                               value,
                                               attn_mask=attn_mask,
                                               key_padding_mask=key_padding_mask)
-        return self.wrap_out(context, weight)
+        return self.wrap_out(context, weight if need_weights else None)
 
 
 class RelMultiheadAttention(ApsMultiheadAttention):
@@ -247,7 +265,9 @@ class RelMultiheadAttention(ApsMultiheadAttention):
         Return:
             logit (Tensor): L x N x H x S
         """
-        term_a = th.einsum("lnhd,snhd->lnhs", query, key)
+        # L x N x H x S
+        term_a = th.matmul(query.permute(1, 2, 0, 3),
+                           key.permute(1, 2, 3, 0)).permute(2, 0, 1, 3)
         # 1) key_rel_pose is L x S x D
         #   a)  term_b = th.einsum(
         #           "...hd,...sd->...hs", query,
@@ -266,7 +286,8 @@ class RelMultiheadAttention(ApsMultiheadAttention):
                 value: th.Tensor,
                 key_rel_pose: Optional[th.Tensor] = None,
                 key_padding_mask: Optional[th.Tensor] = None,
-                attn_mask: Optional[th.Tensor] = None) -> MHSAReturnType:
+                attn_mask: Optional[th.Tensor] = None,
+                need_weights: bool = False) -> MHSAReturnType:
         """
         Args:
             query (Tensor): L x N x E
@@ -275,9 +296,10 @@ class RelMultiheadAttention(ApsMultiheadAttention):
             key_rel_pose (Tensor): 2L(S)-1 x D
             key_padding_mask (Tensor): N x S
             attn_mask (Tensor): L x S, additional mask
+            need_weights (bool): return attention weight or not
         Return:
             context (Tensor): L x N x E
-            weight (Tensor): N x L x S
+            weight (Tensor): N x L x S (if need_weights is True)
         """
         assert key_rel_pose is not None
         # query: L x N x H x D
@@ -291,7 +313,7 @@ class RelMultiheadAttention(ApsMultiheadAttention):
                                               value,
                                               attn_mask=attn_mask,
                                               key_padding_mask=key_padding_mask)
-        return self.wrap_out(context, weight)
+        return self.wrap_out(context, weight if need_weights else None)
 
 
 class XlMultiheadAttention(ApsMultiheadAttention):
@@ -330,13 +352,18 @@ class XlMultiheadAttention(ApsMultiheadAttention):
         Return:
             logit (Tensor): L x N x H x S(L)
         """
-        # L x N x H x S
-        term_ac = th.einsum("lnhd,snhd->lnhs", query + self.rel_u, key)
-        # 2S-1 x E => 2S-1 x H x D
+        # N x H x L x D
+        query = query.permute(1, 2, 0, 3)
+        # N x H x L x S => L x N x H x S
+        term_ac = th.matmul(query + self.rel_u[:, None],
+                            key.permute(1, 2, 3, 0)).permute(2, 0, 1, 3)
+        # 2S-1 x E => 2S-1 x H x D => H x D x 2S-1
         rel_pos = self.rel_proj(sin_pose)
-        rel_pos = rel_pos.view(-1, self.num_heads, self.head_dim)
-        # L x N x H x 2S-1
-        term_bd = th.einsum("lnhd,shd->lnhs", query + self.rel_v, rel_pos)
+        rel_pos = rel_pos.view(-1, self.num_heads,
+                               self.head_dim).permute(1, 2, 0)
+        # N x H x L x 2S-1 => L x N x H x 2S-1
+        term_bd = th.matmul(query + self.rel_v[:, None],
+                            rel_pos).permute(2, 0, 1, 3)
         # L x N x H x S
         return term_ac + digit_shift(term_bd)
 
@@ -346,7 +373,8 @@ class XlMultiheadAttention(ApsMultiheadAttention):
                 value: th.Tensor,
                 sin_pose: Optional[th.Tensor] = None,
                 key_padding_mask: Optional[th.Tensor] = None,
-                attn_mask: Optional[th.Tensor] = None) -> MHSAReturnType:
+                attn_mask: Optional[th.Tensor] = None,
+                need_weights: bool = False) -> MHSAReturnType:
         """
         Args:
             query (Tensor): L x N x E
@@ -355,9 +383,10 @@ class XlMultiheadAttention(ApsMultiheadAttention):
             sin_pose (Tensor): 2S-1 x E
             key_padding_mask (Tensor): N x S
             attn_mask (Tensor): L x S, additional mask
+            need_weights (bool): return attention weight or not
         Return:
             context (Tensor): L x N x E
-            weight (Tensor): N x L x S
+            weight (Tensor): N x L x S (if need_weights is True)
         """
         assert sin_pose is not None
         # query: L x N x H x D
@@ -369,7 +398,7 @@ class XlMultiheadAttention(ApsMultiheadAttention):
                                               value,
                                               attn_mask=attn_mask,
                                               key_padding_mask=key_padding_mask)
-        return self.wrap_out(context, weight)
+        return self.wrap_out(context, weight if need_weights else None)
 
 
 class ApsTransformerEncoderLayer(nn.Module):
@@ -414,12 +443,12 @@ class ApsTransformerEncoderLayer(nn.Module):
         inp = src
         if self.pre_norm:
             src = self.norm1(src)
-        att, _ = self.self_attn(src,
-                                src,
-                                src,
-                                inj_pose,
-                                attn_mask=src_mask,
-                                key_padding_mask=src_key_padding_mask)
+        att = self.self_attn(src,
+                             src,
+                             src,
+                             inj_pose,
+                             attn_mask=src_mask,
+                             key_padding_mask=src_key_padding_mask)[0]
         src = inp + self.dropout(att)
         if self.pre_norm:
             src = src + self.feedforward(self.norm2(src))
@@ -512,12 +541,12 @@ class ApsConformerEncoderLayer(nn.Module):
             src1 = src
         # self-attention block
         src2 = self.norm1(src1)
-        att, _ = self.self_attn(src2,
-                                src2,
-                                src2,
-                                inj_pose,
-                                attn_mask=src_mask,
-                                key_padding_mask=src_key_padding_mask)
+        att = self.self_attn(src2,
+                             src2,
+                             src2,
+                             inj_pose,
+                             attn_mask=src_mask,
+                             key_padding_mask=src_key_padding_mask)[0]
         src = src1 + self.dropout(att)
         # conv
         src = self.conv(self.norm2(src)) + src
@@ -5,9 +5,9 @@
 
 import torch as th
 import torch.nn as nn
-import torch.nn.functional as tf
 
 from typing import Tuple
+from functools import lru_cache
 
 
 def digit_shift(term: th.Tensor) -> th.Tensor:
@@ -24,23 +24,23 @@ def digit_shift(term: th.Tensor) -> th.Tensor:
     if L * 2 - 1 != X:
         raise RuntimeError("digit_shift: tensor shape should be: " +
                            f"L x N x H x 2L-1, but got {term.shape}")
-    # L x N x H x 2L
-    term_pad = tf.pad(term, (1, 0))
-    # L x 2L x H x N
-    term_pad = term_pad.transpose(1, -1).contiguous()
-    # 2L x L x H x N
-    term_pad = term_pad.view(2 * L, L, H, N)
-    # L x 2L-1 x H x N
-    term = term_pad[1:].view(L, 2 * L - 1, H, N)
-    # L x L x H x N
-    term = term[:, :L]
-    # L x N x H x L
-    return term.transpose(1, -1)
-
-
-def prep_sub_mask(num_frames: int, device: th.device = "cpu") -> th.Tensor:
+    # L should be the outer dimension compared with 2L-1
+    if term.stride(0) < term.stride(-1):
+        term = term.contiguous()
+    # term[l, ..., s] = term[l, ..., s - l + L - 1], the shift is realized
+    # by the strides (no memory copy): L x N x H x L
+    sL, sN, sH, sX = term.stride()
+    return term.as_strided((L, N, H, L), (sL - sX, sN, sH, sX),
+                           term.storage_offset() + (L - 1) * sX)
+
+
+@lru_cache(maxsize=32)
+def prep_sub_mask(num_frames: int,
+                  device: th.device = "cpu",
+                  dtype: th.dtype = th.float32) -> th.Tensor:
     """
-    Prepare the square sub-sequence masks (-inf/0)
+    Prepare the square sub-sequence masks (-inf/0), cached on (num_frames,
+    device, dtype), so the returned tensor should not be modified in-place
     e.g., for num_frames = 8:
     tensor([[0., -inf, -inf, -inf, -inf, -inf, -inf, -inf],
         [0., 0., -inf, -inf, -inf, -inf, -inf, -inf],
@@ -51,10 +51,11 @@ def prep_sub_mask(num_frames: int, device: th.device = "cpu") -> th.Tensor:
         [0., 0., 0., 0., 0., 0., 0., -inf],
         [0., 0., 0., 0., 0., 0., 0., 0.]])
     """
-    ones = th.ones(num_frames, num_frames, device=device)
-    mask = (th.triu(ones, diagonal=1) == 1).float()
-    mask = mask.masked_fill(mask == 1, float("-inf"))
-    return mask
+    mask = th.full((num_frames, num_frames),
+                   float("-inf"),
+                   dtype=dtype,
+                   device=device)
+    return mask.triu_(diagonal=1)
 
 
 def prep_context_mask(num_frames: int,
@@ -14,6 +14,7 @@ MATH_PI = math.pi
 EPSILON = float(np.finfo(np.float32).eps)
 MAX_INT16 = np.iinfo(np.int16).max
 UNK_TOKEN = "<unk>"
+SOS_TOKEN = "<sos>"
 BLK_TOKEN = "<b>"
 OOM_STRING = "out of memory"
 TORCH_VERSION = float(".".join(th.__version__.split(".")[:2]))
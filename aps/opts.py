@@ -158,6 +158,16 @@ def get_aps_decode_parser():
                         type=str,
                         default="best",
                         help="Tag name for RNNLM")
+    parser.add_argument("--lm-quantize",
+                        action=StrToBoolAction,
+                        default=False,
+                        help="If true, apply int8 dynamic quantization "
+                        "to the NN LM (only on CPU)")
+    parser.add_argument("--autocast",
+                        action=StrToBoolAction,
+                        default=False,
+                        help="If true, run the decoding under bf16 "
+                        "th.autocast (requires PyTorch >= 1.10)")
     parser.add_argument("--temperature",
                         type=float,
                         default=1,
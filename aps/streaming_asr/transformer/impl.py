@@ -62,17 +62,18 @@ class StreamingRelMultiheadAttention(RelMultiheadAttention):
             key = th.cat([self.cache_k, key], 0)
         C = query.shape[0]
         # T x N x H x T
-        term_a = th.einsum("lnhd,snhd->lnhs", query, key)
+        term_a = th.matmul(query.permute(1, 2, 0, 3),
+                           key.permute(1, 2, 3, 0)).permute(2, 0, 1, 3)
         rel_pose = key_rel_pose[-C:, -C:]
         term_b = th.matmul(query, rel_pose[:, None].transpose(-1, -2))
         # T x N x H x T
         logit = term_a + term_b
         # T x N x E
-        context, weight = self.context_weight(logit,
-                                              value,
-                                              attn_mask=None,
-                                              key_padding_mask=None)
-        context = self.wrap_out(context, weight)[0]
+        context, _ = self.context_weight(logit,
+                                         value,
+                                         attn_mask=None,
+                                         key_padding_mask=None)
+        context = self.wrap_out(context, None)[0]
         self.init = False
         if self.lctx:
             self.cache_q = query[-self.lctx:]
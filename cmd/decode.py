@@ -5,6 +5,7 @@
 
 import pprint
 import argparse
+import contextlib
 
 import numpy as np
 import torch as th
@@ -12,8 +13,10 @@ import torch as th
 from pathlib import Path
 from aps.eval import NnetEvaluator, TextPostProcessor
 from aps.opts import DecodingParser
+from aps.asr.transducers import ASRTransducerBase
+from aps.asr.beam_search.lm import quantize_lm
 from aps.conf import load_dict
-from aps.const import UNK_TOKEN
+from aps.const import UNK_TOKEN, SOS_TOKEN
 from aps.utils import get_logger, io_wrapper, SimpleTimer
 from aps.loader import AudioReader
 
@@ -53,7 +56,8 @@ class FasterDecoder(NnetEvaluator):
                  cpt_dir: str,
                  cpt_tag: str = "best",
                  function: str = "beam_search",
-                 device_id: int = -1) -> None:
+                 device_id: int = -1,
+                 autocast: bool = False) -> None:
         super(FasterDecoder, self).__init__(cpt_dir,
                                             cpt_tag=cpt_tag,
                                             device_id=device_id)
@@ -63,13 +67,22 @@ class FasterDecoder(NnetEvaluator):
         self.decode = getattr(self.nnet, function)
         self.function = function
         logger.info(f"Use decoding function: {function}")
+        if autocast and not hasattr(th, "autocast"):
+            raise RuntimeError("--autocast requires PyTorch >= 1.10")
+        self.autocast = autocast
+
+    def autocast_context(self):
+        if not self.autocast:
+            return contextlib.nullcontext()
+        return th.autocast(self.device.type, dtype=th.bfloat16)
 
     def run(self, src, **kwargs):
         src = th.from_numpy(src).to(self.device)
-        if self.function == "greedy_search":
-            return self.decode(src)
-        else:
-            return self.decode(src, **kwargs)
+        with self.autocast_context():
+            if self.function == "greedy_search":
+                return self.decode(src)
+            else:
+                return self.decode(src, **kwargs)
 
 
 def run(args):
@@ -78,7 +91,8 @@ def run(args):
     decoder = FasterDecoder(args.am,
                             cpt_tag=args.am_tag,
                             function=args.function,
-                            device_id=args.device_id)
+                            device_id=args.device_id,
+                            autocast=args.autocast)
     if decoder.accept_raw:
         src_reader = AudioReader(args.feats_or_wav_scp,
                                  sr=args.sr,
@@ -99,6 +113,12 @@ def run(args):
             logger.info(f"Load NN LM from {args.lm}: epoch {lm.epoch}, " +
                         f"weight = {args.lm_weight}")
             lm = lm.nnet
+            if args.lm_quantize:
+                if args.device_id >= 0:
+                    logger.warning("--lm-quantize only works on CPU, skip")
+                else:
+                    lm = quantize_lm(lm)
+                    logger.info("Apply int8 dynamic quantization to NN LM")
     else:
         lm = None
 
@@ -125,13 +145,15 @@ def run(args):
         filter(lambda x: x[0] in beam_search_params,
                vars(args).items()))
     dec_args["lm"] = lm
+    vocab_dict = load_dict(args.dict) if args.dict else {}
     unk_idx = -1
-    if args.dict and args.disable_unk:
-        vocab_dict = load_dict(args.dict)
-        if UNK_TOKEN in vocab_dict:
-            unk_idx = vocab_dict[UNK_TOKEN]
-            logger.info(f"Use unknown token {UNK_TOKEN} index: {unk_idx}")
+    if args.disable_unk and UNK_TOKEN in vocab_dict:
+        unk_idx = vocab_dict[UNK_TOKEN]
+        logger.info(f"Use unknown token {UNK_TOKEN} index: {unk_idx}")
     dec_args["unk"] = unk_idx
+    # RNN-T LM fusion starts from <sos> (AM gets it from the nnet config)
+    if isinstance(decoder.nnet, ASRTransducerBase) and SOS_TOKEN in vocab_dict:
+        dec_args["sos"] = vocab_dict[SOS_TOKEN]
     done = 0
     tot_utts = len(src_reader)
     for key, src in src_reader:
@@ -6,12 +6,14 @@
 import pprint
 import argparse
 import warnings
+import contextlib
 
 import numpy as np
 import torch as th
 
 from pathlib import Path
 from aps.opts import DecodingParser
+from aps.asr.beam_search.lm import quantize_lm
 from aps.eval import NnetEvaluator, TextPostProcessor
 from aps.conf import load_dict
 from aps.const import UNK_TOKEN
@@ -38,14 +40,24 @@ class BatchDecoder(NnetEvaluator):
     def __init__(self,
                  cpt_dir: str,
                  device_id: int = -1,
-                 cpt_tag: str = "best") -> None:
+                 cpt_tag: str = "best",
+                 autocast: bool = False) -> None:
         super(BatchDecoder, self).__init__(cpt_dir,
                                            device_id=device_id,
                                            cpt_tag=cpt_tag)
+        if autocast and not hasattr(th, "autocast"):
+            raise RuntimeError("--autocast requires PyTorch >= 1.10")
+        self.autocast = autocast
+
+    def autocast_context(self):
+        if not self.autocast:
+            return contextlib.nullcontext()
+        return th.autocast(self.device.type, dtype=th.bfloat16)
 
     def run(self, inps, **kwargs):
-        return self.nnet.beam_search_batch(
-            [th.from_numpy(t).to(self.device) for t in inps], **kwargs)
+        with self.autocast_context():
+            return self.nnet.beam_search_batch(
+                [th.from_numpy(t).to(self.device) for t in inps], **kwargs)
 
 
 def run(args):
@@ -54,7 +66,8 @@ def run(args):
         warnings.warn("can use decode.py instead as batch_size == 1")
     decoder = BatchDecoder(args.am,
                            device_id=args.device_id,
-                           cpt_tag=args.am_tag)
+                           cpt_tag=args.am_tag,
+                           autocast=args.autocast)
     if decoder.accept_raw:
         src_reader = AudioReader(args.feats_or_wav_scp,
                                  sr=args.sr,
@@ -75,6 +88,12 @@ def run(args):
             logger.info(f"Load NN LM from {args.lm}: epoch {lm.epoch}, " +
                         f"weight = {args.lm_weight}")
             lm = lm.nnet
+            if args.lm_quantize:
+                if args.device_id >= 0:
+                    logger.warning("--lm-quantize only works on CPU, skip")
+                else:
+                    lm = quantize_lm(lm)
+                    logger.info("Apply int8 dynamic quantization to NN LM")
     else:
         lm = None
 
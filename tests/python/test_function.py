@@ -6,12 +6,16 @@
 import pytest
 import torch as th
 import torch.nn as nn
+import torch.nn.functional as tf
 
 from aps.libs import dynamic_importlib, ApsRegisters, ApsModules
 from aps.conf import load_dict
 from aps.asr.transformer.impl import ApsMultiheadAttention
 from aps.asr.transformer.utils import digit_shift, prep_sub_mask
 from aps.asr.base.attention import padding_mask
+from aps.asr.transducer.decoder import PyTorchRNNDecoder
+from aps.asr.beam_search.transducer import greedy_search, beam_search
+from aps.asr.beam_search.transducer import prefix_hash, match_hypos
 
 
 @pytest.mark.parametrize(
@@ -88,7 +92,8 @@ def test_aps_selfattn(index):
                          value,
                          None,
                          key_padding_mask=key_padding_mask,
-                         attn_mask=attn_mask)
+                         attn_mask=attn_mask,
+                         need_weights=True)
     th1, th2 = self_attn.torch_forward(query,
                                        key,
                                        value,
@@ -98,3 +103,135 @@ def test_aps_selfattn(index):
     assert my2.shape == th2.shape
     th.testing.assert_allclose(my2, th2)
     th.testing.assert_allclose(my1, th1)
+
+
+@pytest.mark.parametrize("index", [0, 1, 2])
+@pytest.mark.parametrize("mask", ["key_padding", "attn", "both"])
+@pytest.mark.parametrize("need_weights", [True, False])
+def test_aps_selfattn_impl(index, mask, need_weights):
+    S, L, N, E = 100, 100, 8, 256
+    # use own implementation instead of tf.multi_head_attention_forward
+    self_attn = ApsMultiheadAttention(E, 4, dropout=0, use_torch=False)
+    self_attn.train()
+    query = th.rand(L, N, E)
+    if index == 0:
+        key, value = query, query
+    elif index == 1:
+        key = th.rand(S, N, E)
+        value = key
+    else:
+        key = th.rand(S, N, E)
+        value = th.rand(S, N, E)
+
+    key_len = th.randint(S // 2, S, (N,))
+    key_len[0] = S
+    key_padding_mask = padding_mask(key_len) if mask != "attn" else None
+    attn_mask = prep_sub_mask(S) if mask != "key_padding" else None
+
+    my = self_attn(query,
+                   key,
+                   value,
+                   None,
+                   key_padding_mask=key_padding_mask,
+                   attn_mask=attn_mask,
+                   need_weights=need_weights)
+    th1, th2 = self_attn.torch_forward(query,
+                                       key,
+                                       value,
+                                       key_padding_mask=key_padding_mask,
+                                       attn_mask=attn_mask)
+    assert len(my) == (2 if need_weights else 1)
+    assert my[0].shape == th1.shape
+    th.testing.assert_allclose(my[0], th1)
+    if need_weights:
+        th.testing.assert_allclose(my[1], th2)
+
+
+def rnnt_greedy_search_ref(decoder, enc_out, blank):
+    """
+    Frame-by-frame version of the RNN-T greedy search
+    """
+    blk = th.tensor([[blank]], dtype=th.int64)
+    dec_out, hidden = decoder.step(blk)
+    score = 0
+    trans = []
+    for t in range(enc_out.shape[1]):
+        prob = tf.log_softmax(decoder.pred(enc_out[:, t], dec_out)[0], dim=-1)
+        best_prob, best_pred = th.max(prob, dim=-1)
+        score += best_prob.item()
+        if best_pred.item() != blank:
+            dec_out, hidden = decoder.step(best_pred[None, ...], hidden=hidden)
+            trans += [best_pred.item()]
+    return score, [blank] + trans + [blank]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 8])
+@pytest.mark.parametrize("blank_ratio", [0, 0.5, 0.9])
+def test_rnnt_greedy_search(chunk_size, blank_ratio):
+    V, T = 30, 50
+    decoder = PyTorchRNNDecoder(V,
+                                embed_size=32,
+                                enc_dim=16,
+                                jot_dim=32,
+                                hidden=32,
+                                num_layers=1)
+    decoder.eval()
+    # blank wins on the frames along +vec and loses along -vec
+    vec = th.randn(16)
+    decoder.output.weight.data[-1] = 3 * th.sign(
+        decoder.enc_proj.weight.data @ vec)
+    sign = (th.rand(T) < blank_ratio).float() * 2 - 1
+    enc_out = sign[None, :, None] * vec * 4 + th.randn(1, T, 16) * 0.5
+    with th.no_grad():
+        ref_score, ref_trans = rnnt_greedy_search_ref(decoder,
+                                                      enc_out,
+                                                      blank=V - 1)
+        hyp = greedy_search(decoder,
+                            enc_out,
+                            blank=V - 1,
+                            chunk_size=chunk_size)
+    assert hyp[0]["trans"] == ref_trans
+    assert abs(hyp[0]["score"] - ref_score) < 1e-3
+
+
+def test_rnnt_prefix_merge():
+    blank = 9
+    prefix = [[blank, 1, 2], [blank, 1], [blank, 2, 1], [blank, 1, 2]]
+    hash_a = []
+    for trans in prefix:
+        h = 0
+        for tok in trans:
+            h = prefix_hash(h, tok)
+        hash_a.append(h)
+    assert len(set(hash_a)) == 3
+    # [blank, 1, 2] is already in B
+    slot_b = {hash_a[0]: 0}
+    new, dup = match_hypos(hash_a, slot_b)
+    assert new == [1, 2]
+    assert dup == [(0, 0), (3, 0)]
+    assert slot_b == {hash_a[0]: 0, hash_a[1]: 1, hash_a[2]: 2}
+
+
+@pytest.mark.parametrize("beam_size", [2, 4, 8])
+def test_rnnt_beam_search(beam_size):
+    V, T = 30, 40
+    decoder = PyTorchRNNDecoder(V,
+                                embed_size=32,
+                                enc_dim=16,
+                                jot_dim=32,
+                                hidden=32,
+                                num_layers=1)
+    decoder.eval()
+    enc_out = th.randn(1, T, 16) * 3
+    with th.no_grad():
+        nbest = beam_search(decoder,
+                            enc_out,
+                            beam_size=beam_size,
+                            blank=V - 1,
+                            nbest=beam_size,
+                            len_norm=False)
+    # duplicated prefixes are merged, so the n-best list is unique
+    trans = [tuple(hyp["trans"]) for hyp in nbest]
+    assert len(set(trans)) == len(trans)
+    score = [hyp["score"] for hyp in nbest]
+    assert score == sorted(score, reverse=True)
@@ -5,8 +5,10 @@
 
 import pytest
 import torch as th
+import torch.nn as nn
 
 from aps.libs import aps_asr_nnet
+from aps.asr.beam_search.lm import quantize_lm
 from aps.transform import AsrTransform, EnhTransform
 from aps.asr.base.encoder import Conv1dEncoder, Conv2dEncoder
 
@@ -591,3 +593,83 @@ def test_xfmr_transducer(enc_type, enc_kwargs):
     x, x_len, y, y_len, u = gen_egs(vocab_size, batch_size)
     _, z, _ = xfmr_rnnt(x, x_len, y, y_len)
     assert z.shape[2:] == th.Size([u + 1, vocab_size])
+
+
+small_lm_conf = [
+    pytest.param("asr@rnn_lm", {
+        "embed_size": 128,
+        "rnn": "lstm",
+        "num_layers": 1,
+        "hidden_size": 128
+    }),
+    pytest.param(
+        "asr@xfmr_lm", {
+            "num_layers": 1,
+            "arch_kwargs": {
+                "att_dim": 128,
+                "nhead": 4,
+                "feedforward_dim": 256
+            }
+        })
+]
+
+
+@pytest.mark.parametrize("lm_type,lm_kwargs", small_lm_conf)
+def test_transducer_beam_search_with_lm(lm_type, lm_kwargs):
+    nnet_cls = aps_asr_nnet("asr@transducer")
+    # vocab_size = #dict + 1 (blank) for AM while #dict for LM
+    vocab_size = 100
+    dec_kwargs = {
+        "embed_size": 128,
+        "enc_dim": 128,
+        "jot_dim": 128,
+        "rnn": "lstm",
+        "num_layers": 1,
+        "hidden": 128
+    }
+    asr_transform = AsrTransform(feats="fbank-log-cmvn",
+                                 frame_len=400,
+                                 frame_hop=160,
+                                 window="hamm")
+    rnnt = nnet_cls(input_size=80,
+                    vocab_size=vocab_size,
+                    asr_transform=asr_transform,
+                    enc_type="variant_rnn",
+                    enc_proj=128,
+                    enc_kwargs=custom_rnn_enc_kwargs,
+                    dec_kwargs=dec_kwargs)
+    rnnt.eval()
+    lm = aps_asr_nnet(lm_type)(vocab_size=vocab_size - 1, **lm_kwargs)
+    lm.eval()
+    x = th.rand(16000)
+    nbest = rnnt.beam_search(x,
+                             lm=lm,
+                             lm_weight=0.2,
+                             beam_size=4,
+                             nbest=4,
+                             sos=vocab_size - 2)
+    assert len(nbest) == 4
+    for hyp in nbest:
+        assert hyp["trans"][0] == hyp["trans"][-1] == vocab_size - 1
+        assert max(hyp["trans"][1:-1], default=0) < vocab_size - 1
+
+
+@pytest.mark.parametrize("lm_type,lm_kwargs", small_lm_conf)
+def test_quantize_lm(lm_type, lm_kwargs):
+    vocab_size = 100
+    lm = aps_asr_nnet(lm_type)(vocab_size=vocab_size, **lm_kwargs)
+    lm.eval()
+    lm = quantize_lm(lm)
+    dynamic = (th.nn.quantized.dynamic.Linear, th.nn.quantized.dynamic.LSTM)
+    assert any(isinstance(mod, dynamic) for mod in lm.modules())
+    for name, mod in lm.named_modules():
+        if name.endswith("self_attn.out_proj"):
+            # kept as float for tf.multi_head_attention_forward(...)
+            assert type(mod) is nn.Linear
+            assert mod.weight.dtype == th.float32
+        else:
+            assert type(mod) not in (nn.Linear, nn.LSTM)
+    token = th.randint(0, vocab_size, (4, 1))
+    with th.no_grad():
+        prob, _ = lm(token, None)
+    assert prob.shape == th.Size([4, 1, vocab_size])